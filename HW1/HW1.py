@@ -1,10 +1,55 @@
 from collections import defaultdict
 from itertools import combinations
+import math
+import os
 import sys
 
+# Below this fraction of non-zero (transaction, item) cells the tidsets are
+# stored as sets of transaction ids instead of bitmasks
+SPARSE_DENSITY = 0.05
+
+# Levels with more candidates than this are counted by a pool of forked
+# worker processes, one chunk per usable CPU, when more than one CPU is usable
+PARALLEL_THRESHOLD = 1000
+
+# (item_tids, order_key, tid_count, empty_tids) inherited by forked workers
+shared_index = None
+
+def intersect_counts(candidates, index=None):
+    """Count supports of sorted-tuple candidates against a tidset index"""
+    item_tids, order_key, tid_count, empty_tids = index or shared_index
+    # Bind everything the inner loop touches to locals and intersect inline,
+    # avoiding a method call, generator and key lambda per candidate
+    tids_get = item_tids.get
+    
+    counts = []
+    for candidate in candidates:
+        # order_key is only set for frozenset tidsets, where intersecting the
+        # rarest item first shrinks the work; int & costs the same either way
+        items = sorted(candidate, key=order_key) if order_key else candidate
+        tids = tids_get(items[0], empty_tids)
+        for item in items[1:]:
+            tids &= tids_get(item, empty_tids)
+        counts.append(tid_count(tids))
+    return counts
+
+def usable_cpus():
+    """Number of CPUs this process may run on"""
+    if hasattr(os, 'sched_getaffinity'):
+        return len(os.sched_getaffinity(0))
+    return os.cpu_count() or 1
+
 class MSApriori:
     def __init__(self):
         self.transactions = []
+        self.item_tids = {}  # item -> tidset of transactions containing it
+        self.empty_tids = 0
+        self.tid_count = int.bit_count
+        self.sparse_tids = False  # True when tidsets are frozensets rather than bitmasks
+        self.tid_popcount = {}  # item -> number of transactions containing it
+        self.mis_lookup = {}  # item -> MIS, for every item in the data
+        self.price_lookup = {}  # item -> price, for every item in the data
+        self.mis_count_lookup = {}  # item -> minimum support count meeting its MIS
         self.mis_values = {}
         self.prices = {}
         self.sdc = 0.0
@@ -12,6 +57,8 @@ class MSApriori:
         self.total_transactions = 0
         self.frequent_itemsets = {}
         self.item_support_cache = {}  # Cache for 1-item supports
+        self.support_cache = {}  # sorted itemset tuple -> support count, for get_support_count
+        self.frequent_support = {}  # k -> {itemset tuple: support count} of frequent k-itemsets
 
     def read_data_file(self, filename):
         """Read transaction data from file"""
@@ -20,31 +67,56 @@ class MSApriori:
                 for line in f:
                     line = line.strip()
                     if line:
-                        transaction = [int(x.strip()) for x in line.split(',') if x.strip()]
+                        try:
+                            # int() skips surrounding whitespace itself, so clean
+                            # lines parse entirely in C
+                            transaction = set(map(int, line.split(',')))
+                        except ValueError:
+                            # Byte order mark or empty fields
+                            transaction = {int(x.strip('\ufeff').strip()) for x in line.split(',') if x.strip()}
                         if transaction:
-                            self.transactions.append(set(transaction))
-            self.total_transactions = len(self.transactions)
-            print(f"Read {self.total_transactions} transactions")
-        except FileNotFoundError:
-            print(f"Error: Could not find data file '{filename}'")
-            sys.exit(1)
-
-    def read_data_file(self, filename):
-        """Read transaction data from file"""
-        try:
-            with open(filename, 'r') as f:
-                for line in f:
-                    line = line.strip()
-                    if line:
-                        transaction = [int(x.strip('\ufeff').strip()) for x in line.split(',') if x.strip()]
-                        if transaction:
-                            self.transactions.append(set(transaction))
+                            self.transactions.append(transaction)
             self.total_transactions = len(self.transactions)
+            self.build_tid_index()
+            self.transactions = []
             print(f"Read {self.total_transactions} transactions")
         except FileNotFoundError:
             print(f"Error: Could not find data file '{filename}'")
             sys.exit(1)
     
+    def build_tid_index(self):
+        """
+        Build the vertical index item -> tidset. Dense data uses int bitmasks
+        (bit i set iff transaction i contains the item); sparse data uses
+        frozensets of transaction ids so only non-zeros are intersected
+        """
+        tid_lists = defaultdict(list)
+        for tid, transaction in enumerate(self.transactions):
+            for item in transaction:
+                tid_lists[item].append(tid)
+        
+        nnz = sum(len(tids) for tids in tid_lists.values())
+        cells = self.total_transactions * len(tid_lists)
+        
+        if cells and nnz / cells < SPARSE_DENSITY:
+            self.item_tids = {item: frozenset(tids) for item, tids in tid_lists.items()}
+            self.empty_tids = frozenset()
+            self.tid_count = len
+            self.sparse_tids = True
+        else:
+            num_bytes = (self.total_transactions + 7) // 8
+            for item, tids in tid_lists.items():
+                bits = bytearray(num_bytes)
+                for tid in tids:
+                    bits[tid >> 3] |= 1 << (tid & 7)
+                self.item_tids[item] = int.from_bytes(bits, 'little')
+            self.empty_tids = 0
+            self.tid_count = int.bit_count
+            self.sparse_tids = False
+        self.tid_popcount = {item: len(tids) for item, tids in tid_lists.items()}
+        self.item_support_cache = {item: count / self.total_transactions
+                                   for item, count in self.tid_popcount.items()}
+    
     def read_parameter_file(self, filename):
         """Read MIS values, prices, SDC, and AVPT from parameter file"""
         self.mis_rest = 0.01
@@ -101,59 +173,103 @@ class MSApriori:
         """Get price for an item"""
         return self.prices.get(item, self.price_rest)
     
+    def build_item_lookups(self):
+        """Resolve MIS and price of every item in the data once, defaults included"""
+        self.mis_lookup = {item: self.get_mis(item) for item in self.item_tids}
+        self.price_lookup = {item: self.get_price(item) for item in self.item_tids}
+        self.mis_count_lookup = {item: self.mis_to_count(mis) for item, mis in self.mis_lookup.items()}
+    
+    def mis_to_count(self, mis):
+        """
+        Smallest support count c with c / total_transactions >= mis, nudged so
+        the integer test agrees exactly with the float ratio comparison
+        """
+        total = self.total_transactions
+        count = max(math.ceil(mis * total), 0)
+        while count > 0 and (count - 1) / total >= mis:
+            count -= 1
+        while count / total < mis:
+            count += 1
+        return count
+    
     def get_support_count(self, itemset):
-        """Calculate support count for an itemset with optimized counting"""
-        count = 0
-        itemset_tuple = tuple(sorted(itemset))
-        
-        for transaction in self.transactions:
-            if itemset.issubset(transaction):
-                count += 1
+        """Calculate support count for an itemset by intersecting item tidsets"""
+        key = tuple(sorted(itemset))
+        if not key:
+            return self.total_transactions
+        count = self.support_cache.get(key)
+        if count is None:
+            count = intersect_counts([key], self.tid_index())[0]
+            self.support_cache[key] = count
         return count
     
-    def get_tail_count(self, itemset):
+    def count_supports(self, candidates):
+        """Calculate support counts for a whole level of sorted-tuple candidates in one batch"""
+        # Candidates never repeat across levels, so these counts are not cached;
+        # the frequent ones are indexed by add_frequent_level instead
+        # Candidates are independent, so big levels are split across processes
+        if len(candidates) > PARALLEL_THRESHOLD and usable_cpus() > 1:
+            return self.count_supports_parallel(candidates)
+        return intersect_counts(candidates, self.tid_index())
+    
+    def count_supports_parallel(self, candidates):
+        """
+        Count supports on a pool of forked worker processes, which inherit
+        the tidset index instead of unpickling it. Each worker gets one
+        contiguous chunk so IPC stays small next to the ANDs. Counts serially
+        where fork is unavailable
+        """
+        # Imported here so small runs don't pay for loading them
+        import multiprocessing
+        from concurrent.futures import ProcessPoolExecutor
+        global shared_index
+        
+        if 'fork' not in multiprocessing.get_all_start_methods():
+            return intersect_counts(candidates, self.tid_index())
+        
+        workers = usable_cpus()
+        chunk_size = -(-len(candidates) // workers)
+        chunks = [candidates[i:i + chunk_size] for i in range(0, len(candidates), chunk_size)]
+        shared_index = self.tid_index()
+        try:
+            with ProcessPoolExecutor(max_workers=workers,
+                                     mp_context=multiprocessing.get_context('fork')) as executor:
+                return [count for chunk_counts in executor.map(intersect_counts, chunks)
+                        for count in chunk_counts]
+        finally:
+            shared_index = None
+    
+    def tid_index(self):
+        """Tidset index tuple in the form intersect_counts expects"""
+        order_key = self.tid_popcount.get if self.sparse_tids else None
+        return (self.item_tids, order_key, self.tid_count, self.empty_tids)
+    
+    def get_tail_count(self, itemset, prefix_support=None):
         """
         Calculate tail count - transactions containing all items except the last one
         For sorted itemset [i1, i2, ..., ik], tail count is count of transactions 
         containing [i1, i2, ..., i(k-1)]
+        prefix_support is the frequent (k-1)-itemset support index, which callers
+        looping over a whole level can fetch once and pass in
         """
         if len(itemset) <= 1:
             return self.total_transactions
         
-        sorted_items = sorted(list(itemset))
-        prefix = set(sorted_items[:-1])
+        prefix = itemset[:-1]
         
-        count = 0
-        for transaction in self.transactions:
-            if prefix.issubset(transaction):
-                count += 1
-        return count
+        # The prefix is normally a frequent (k-1)-itemset whose support is already known
+        if prefix_support is None:
+            prefix_support = self.frequent_support.get(len(prefix), {})
+        if prefix in prefix_support:
+            return prefix_support[prefix]
+        return self.get_support_count(prefix)
     
     def get_average_price(self, itemset):
         """Calculate average price of items in itemset"""
-        total_price = sum(self.get_price(item) for item in itemset)
+        price = self.price_lookup
+        total_price = sum(price[item] for item in itemset)
         return total_price / len(itemset)
     
-    def satisfies_sdc(self, itemset):
-        """Check if itemset satisfies Support Difference Constraint"""
-        if len(itemset) <= 1:
-            return True
-        
-        supports = []
-        for item in itemset:
-            # Use cached support if available
-            if item in self.item_support_cache:
-                supports.append(self.item_support_cache[item])
-            else:
-                support = self.get_support_count({item}) / self.total_transactions
-                self.item_support_cache[item] = support
-                supports.append(support)
-        
-        max_support = max(supports)
-        min_support = min(supports)
-        
-        return (max_support - min_support) <= self.sdc
-    
     def satisfies_avpt(self, itemset):
         """Check if itemset satisfies Average Price Threshold"""
         avg_price = self.get_average_price(itemset)
@@ -161,23 +277,17 @@ class MSApriori:
     
     def init_pass(self):
         """Initial pass to find frequent 1-itemsets using MSApriori logic"""
-        # Count individual items
-        item_counts = defaultdict(int)
-        for transaction in self.transactions:
-            for item in transaction:
-                item_counts[item] += 1
-        
-        # Cache support values
-        for item, count in item_counts.items():
-            self.item_support_cache[item] = count / self.total_transactions
+        # Individual item counts and supports were computed when indexing
+        item_counts = self.tid_popcount
+        mis = self.mis_lookup
         
         # Sort items by MIS values (ascending), then by item number
-        all_items = sorted(item_counts.keys(), key=lambda x: (self.get_mis(x), x))
+        all_items = sorted(item_counts.keys(), key=lambda x: (mis[x], x))
         
         # Find M = first item with support >= MIS(item)
         M = None
         for item in all_items:
-            if self.item_support_cache[item] >= self.get_mis(item):
+            if self.item_support_cache[item] >= mis[item]:
                 M = item
                 break
         
@@ -188,16 +298,16 @@ class MSApriori:
         frequent_1_itemsets = []
         
         for item in all_items:
-            itemset = {item}
+            itemset = (item,)
             support_count = item_counts[item]
             
             # Item must have support >= MIS(M) (not its own MIS for items after M)
             # This is the key difference in MSApriori
             if item == M:
-                min_support = self.get_mis(M)
+                min_support = mis[M]
             else:
                 # For items after M in sorted order, use MIS(M)
-                min_support = self.get_mis(M)
+                min_support = mis[M]
             
             support = self.item_support_cache[item]
             
@@ -212,7 +322,7 @@ class MSApriori:
     def level2_candidate_gen(self, frequent_1):
         """Generate level-2 candidates using MSApriori-specific logic"""
         candidates = []
-        items_list = [list(itemset)[0] for itemset, _, _, _ in frequent_1]
+        items_list = [itemset[0] for itemset, _, _, _ in frequent_1]
         
         for i in range(len(items_list)):
             for j in range(i + 1, len(items_list)):
@@ -220,52 +330,55 @@ class MSApriori:
                 item_j = items_list[j]
                 
                 # Check if support(item_i) >= MIS(item_i)
-                if self.item_support_cache[item_i] >= self.get_mis(item_i):
-                    candidate = {item_i, item_j}
+                if self.item_support_cache[item_i] >= self.mis_lookup[item_i]:
+                    candidate = (item_i, item_j) if item_i < item_j else (item_j, item_i)
                     candidates.append(candidate)
         
         return candidates
     
     def msapriori_candidate_gen(self, frequent_prev, k):
         """Generate candidates of size k using MSApriori join and prune steps"""
-        candidates = []
-        itemsets = [(frozenset(itemset), count, tc, ap) for itemset, count, tc, ap in frequent_prev]
+        # Bucket the (already sorted) frequent itemsets by their first k-2 items,
+        # keeping the original positions so candidates come out in join order
+        sorted_tuples = [itemset for itemset, _, _, _ in frequent_prev]
+        prefix_groups = defaultdict(list)
+        for position, itemset in enumerate(sorted_tuples):
+            prefix_groups[itemset[:-1]].append((position, itemset))
         
-        # Join step: join itemsets that differ by exactly one item
-        for i in range(len(itemsets)):
-            for j in range(i + 1, len(itemsets)):
-                set_i = set(itemsets[i][0])
-                set_j = set(itemsets[j][0])
-                
-                # Create sorted lists
-                list_i = sorted(list(set_i))
-                list_j = sorted(list(set_j))
-                
-                # Check if first k-2 items are the same
-                if list_i[:-1] == list_j[:-1]:
-                    # Create candidate by union
-                    candidate = set_i.union(set_j)
-                    
-                    if len(candidate) == k:
-                        candidates.append(candidate)
+        # Join step: join itemsets that differ only in their last item
+        joined = []
+        for group in prefix_groups.values():
+            for a in range(len(group)):
+                i, tuple_i = group[a]
+                for b in range(a + 1, len(group)):
+                    j, tuple_j = group[b]
+                    if tuple_i[-1] < tuple_j[-1]:
+                        candidate = tuple_i + (tuple_j[-1],)
+                    else:
+                        candidate = tuple_j + (tuple_i[-1],)
+                    joined.append(((i, j), candidate))
+        joined.sort()
+        candidates = [candidate for _, candidate in joined]
         
         # Prune step: remove candidates with infrequent subsets
         pruned_candidates = []
-        frequent_sets = set(itemsets[i][0] for i in range(len(itemsets)))
+        is_frequent = set(sorted_tuples).__contains__
+        mis = self.mis_lookup
         
         for candidate in candidates:
-            sorted_items = sorted(list(candidate))
-            c1 = sorted_items[0]  # First item
+            c1 = candidate[0]  # First item
+            mis_c1 = mis[c1]
             
-            # Check all (k-1)-subsets
+            # Check the (k-1)-subsets; dropping either of the last two items
+            # gives back the joined parents, which are frequent already
             all_subsets_frequent = True
             
-            for item in candidate:
-                subset = candidate - {item}
+            for idx in range(len(candidate) - 2):
+                item = candidate[idx]
                 
                 # Special check: if subset contains c1 or MIS(item) = MIS(c1)
-                if c1 in subset or self.get_mis(item) == self.get_mis(c1):
-                    if frozenset(subset) not in frequent_sets:
+                if idx > 0 or mis[item] == mis_c1:
+                    if not is_frequent(candidate[:idx] + candidate[idx + 1:]):
                         all_subsets_frequent = False
                         break
             
@@ -274,9 +387,69 @@ class MSApriori:
         
         return pruned_candidates
     
+    def screen_candidates(self, candidates):
+        """
+        Apply the SDC and AVPT checks in a single pass over each
+        candidate's items, so supports are only counted for the survivors.
+        Returns the survivors and their minimum MIS support count thresholds
+        """
+        item_support = self.item_support_cache
+        price = self.price_lookup
+        mis_count = self.mis_count_lookup
+        sdc = self.sdc
+        avpt = self.avpt
+        
+        screened = []
+        min_counts = []
+        for candidate in candidates:
+            first = candidate[0]
+            min_support = max_support = item_support.get(first, 0.0)
+            total_price = price[first]
+            min_count = mis_count[first]
+            for item in candidate[1:]:
+                support = item_support.get(item, 0.0)
+                if support < min_support:
+                    min_support = support
+                elif support > max_support:
+                    max_support = support
+                total_price += price[item]
+                if mis_count[item] < min_count:
+                    min_count = mis_count[item]
+            
+            if (max_support - min_support <= sdc and
+                total_price / len(candidate) >= avpt):
+                screened.append(candidate)
+                min_counts.append(min_count)
+        
+        return screened, min_counts
+    
+    def evaluate_candidates(self, candidates):
+        """Keep the candidates that meet support, SDC and AVPT requirements"""
+        frequent = []
+        screened, min_counts = self.screen_candidates(candidates)
+        supports = self.count_supports(screened)
+        
+        # All candidates of a level share k, so the (k-1)-prefix support index
+        # used for tail counts is fetched once per level
+        prefix_support = self.frequent_support.get(len(screened[0]) - 1, {}) if screened else {}
+        
+        for candidate, support_count, min_count in zip(screened, supports, min_counts):
+            if support_count >= min_count:
+                tail_count = self.get_tail_count(candidate, prefix_support)
+                avg_price = self.get_average_price(candidate)
+                frequent.append((candidate, support_count, tail_count, avg_price))
+        
+        return frequent
+    
+    def add_frequent_level(self, k, frequent_k):
+        """Record the frequent k-itemsets and index their support counts"""
+        self.frequent_itemsets[k] = frequent_k
+        self.frequent_support[k] = {itemset: count for itemset, count, _, _ in frequent_k}
+    
     def run_msapriori(self):
         """Main MSApriori algorithm with proper implementation"""
         print("Starting MSApriori algorithm...")
+        self.build_item_lookups()
         
         # Initial pass for 1-itemsets
         frequent_1 = self.init_pass()
@@ -284,30 +457,15 @@ class MSApriori:
             print("No frequent 1-itemsets found")
             return
         
-        self.frequent_itemsets[1] = frequent_1
+        self.add_frequent_level(1, frequent_1)
         print(f"Found {len(frequent_1)} frequent 1-itemsets")
         
         # Generate 2-itemsets
         candidates_2 = self.level2_candidate_gen(frequent_1)
-        frequent_2 = []
-        
-        for candidate in candidates_2:
-            support_count = self.get_support_count(candidate)
-            
-            # Use minimum MIS of items in the candidate
-            min_mis = min(self.get_mis(item) for item in candidate)
-            support = support_count / self.total_transactions
-            
-            if (support >= min_mis and 
-                self.satisfies_sdc(candidate) and 
-                self.satisfies_avpt(candidate)):
-                
-                tail_count = self.get_tail_count(candidate)
-                avg_price = self.get_average_price(candidate)
-                frequent_2.append((candidate, support_count, tail_count, avg_price))
+        frequent_2 = self.evaluate_candidates(candidates_2)
         
         if frequent_2:
-            self.frequent_itemsets[2] = frequent_2
+            self.add_frequent_level(2, frequent_2)
             print(f"Found {len(frequent_2)} frequent 2-itemsets")
         else:
             print("No frequent 2-itemsets found")
@@ -321,25 +479,12 @@ class MSApriori:
             if not candidates:
                 break
             
-            frequent_k = []
-            for candidate in candidates:
-                support_count = self.get_support_count(candidate)
-                
-                min_mis = min(self.get_mis(item) for item in candidate)
-                support = support_count / self.total_transactions
-                
-                if (support >= min_mis and 
-                    self.satisfies_sdc(candidate) and 
-                    self.satisfies_avpt(candidate)):
-                    
-                    tail_count = self.get_tail_count(candidate)
-                    avg_price = self.get_average_price(candidate)
-                    frequent_k.append((candidate, support_count, tail_count, avg_price))
+            frequent_k = self.evaluate_candidates(candidates)
             
             if not frequent_k:
                 break
             
-            self.frequent_itemsets[k] = frequent_k
+            self.add_frequent_level(k, frequent_k)
             print(f"Found {len(frequent_k)} frequent {k}-itemsets")
             k += 1
         
@@ -347,17 +492,20 @@ class MSApriori:
     
     def write_output(self, filename):
         """Write results to output file in required format"""
+        # Build every line in memory and write the file in one call
+        lines = []
+        for length in sorted(self.frequent_itemsets.keys()):
+            itemsets = self.frequent_itemsets[length]
+            lines.append("(Length-%d %d" % (length, len(itemsets)))
+            
+            for itemset, freq_count, tail_count, avg_price in itemsets:
+                itemset_str = ' '.join(map(str, itemset))
+                lines.append("(%s) : %d : %d : %.0f" % (itemset_str, freq_count, tail_count, avg_price))
+            
+            lines.append(")")
+        
         with open(filename, 'w') as f:
-            for length in sorted(self.frequent_itemsets.keys()):
-                itemsets = self.frequent_itemsets[length]
-                f.write(f"(Length-{length} {len(itemsets)}\n")
-                
-                for itemset, freq_count, tail_count, avg_price in itemsets:
-                    sorted_items = sorted(list(itemset))
-                    itemset_str = ' '.join(map(str, sorted_items))
-                    f.write(f"({itemset_str}) : {freq_count} : {tail_count} : {avg_price:.0f}\n")
-                
-                f.write(")\n")
+            f.write('\n'.join(lines) + '\n' if lines else '')
         print(f"Results written to {filename}")
 
 def main():